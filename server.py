@@ -1,12 +1,20 @@
 #!/usr/bin/env python
+import asyncio
+import hmac
 import os
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
 from typing import List, Optional, Tuple
 from uuid import uuid4
 from datetime import datetime, timedelta, timezone
 
-from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+import numpy as np
+import orjson
 from dotenv import load_dotenv
 
 from pylibrelinkup import PyLibreLinkUp
@@ -18,18 +26,28 @@ load_dotenv()
 EMAIL = os.getenv("LIBRE_EMAIL")
 PASSWORD = os.getenv("LIBRE_PASSWORD")
 REGION = getattr(APIUrl, os.getenv("LIBRE_REGION", "EU"))
+REGION_STR = str(REGION)  # stringifikace jednou, ne na každý health probe
 
 # Caching & throttling
 CACHE_TTL_SEC = int(os.getenv("CACHE_TTL_SEC", "120"))            # jak dlouho vracet cache
 MIN_FETCH_INTERVAL_SEC = int(os.getenv("MIN_FETCH_INTERVAL_SEC", "70"))  # min. rozestup mezi LLU fetchema
 BACKOFF_AFTER_429_SEC = int(os.getenv("BACKOFF_AFTER_429_SEC", "240"))   # pauza po 429 (Too Many Requests)
 HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "1000"))
+HISTORY_CACHE_TTL_SEC = int(os.getenv("HISTORY_CACHE_TTL_SEC", "60"))  # LLU graf má ~1min vzorky
+
+# timedelty předpočítané jednou – ne alokace na každý request v hot path
+_CACHE_TTL = timedelta(seconds=CACHE_TTL_SEC)
+_MIN_INTERVAL = timedelta(seconds=MIN_FETCH_INTERVAL_SEC)
+_BACKOFF = timedelta(seconds=BACKOFF_AFTER_429_SEC)
 
 # Events store (SQLite) – varování: na Render Free se při redeployi může smazat
 DB_PATH = os.getenv("DB_PATH", "data.db")
 API_KEY = os.getenv("EVENTS_API_KEY")  # potřeba pro /events
 
-app = FastAPI(title="LibreLinkUp API (cache + throttle + events)")
+# Spouštět přes: uvicorn server:app --loop uvloop --http httptools
+# (C-kové event-loop/HTTP-parser primitivy místo čistého Pythonu)
+app = FastAPI(title="LibreLinkUp API (cache + throttle + events)",
+              default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],   # pro produkci přitvrď
@@ -39,15 +57,47 @@ app.add_middleware(
 
 # --- LLU client & cache state (in-memory) ---
 _client: Optional[PyLibreLinkUp] = None
+_patient = None  # zapamatovaný pacient – get_patients() je extra HTTPS round-trip
 _latest_cache: Optional[Tuple[datetime, dict]] = None  # (cached_at, payload)
+_latest_cache_stale: Optional[dict] = None             # týž payload + "stale": True, předpočítaný
 _last_fetch_at: Optional[datetime] = None              # kdy jsme naposledy tahali z LLU
 _next_allowed_fetch_at: Optional[datetime] = None      # kdy smíme zase tahat (throttle/backoff)
 
+# Single-flight: při expiraci cache smí do LLU jen jedna coroutine, ostatní počkají
+# a vezmou si čerstvou cache (double-checked locking)
+_latest_lock = asyncio.Lock()
+
+# Vyhrazený pool pro blokující LLU volání: nesoupeří s default executorem
+# a zároveň shora omezuje souběžné requesty na LLU (rate-limit budget)
+_llu_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="llu")
+_history_locks: dict = {}  # hours -> asyncio.Lock
+_history_cache: dict = {}  # (hours, compact) -> (cached_at, payload)
+
+def _history_lock(hours: int) -> asyncio.Lock:
+    lock = _history_locks.get(hours)
+    if lock is None:
+        lock = _history_locks.setdefault(hours, asyncio.Lock())
+    return lock
+
 # --- DB helpers (SQLite) ---
-def db():
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Jedno dlouhodobé spojení: /events je read-mostly a connect()+close() na každý
+# request zahazuje page cache. Zápisy serializujeme zámkem.
+_conn: Optional[sqlite3.Connection] = None
+_db_write_lock = threading.Lock()
+
+def db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False,
+                                detect_types=sqlite3.PARSE_DECLTYPES)
+        _conn.row_factory = sqlite3.Row
+        _conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-64000;
+        """)
+    return _conn
 
 def init_db():
     conn = db()
@@ -59,43 +109,79 @@ def init_db():
             ts   TEXT NOT NULL
         )
     """)
+    # Range dotazy /events jedou přes ts; bez indexu SQLite full-scanuje + řadí
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts DESC)")
     conn.commit()
-    conn.close()
 
 init_db()
 
+# Čtyři varianty dotazu /events poskládané jednou – statement cache
+# perzistentního spojení pak pokaždé trefí už zkompilovaný plán
+_SQL_EVENTS_BASE = "SELECT id,type,dose,ts FROM events"
+_SQL_EVENTS = {  # (since?, until?) -> SQL
+    (False, False): _SQL_EVENTS_BASE + " ORDER BY ts DESC LIMIT ?",
+    (True, False):  _SQL_EVENTS_BASE + " WHERE ts >= ? ORDER BY ts DESC LIMIT ?",
+    (False, True):  _SQL_EVENTS_BASE + " WHERE ts <= ? ORDER BY ts DESC LIMIT ?",
+    (True, True):   _SQL_EVENTS_BASE + " WHERE ts >= ? AND ts <= ? ORDER BY ts DESC LIMIT ?",
+}
+
+def _normalize_ts(ts: str) -> str:
+    # ts držíme jako ISO-8601 string; lexikografické řazení odpovídá času
+    # jen když je všechno normalizované na UTC
+    try:
+        dt = datetime.fromisoformat(ts)
+    except (TypeError, ValueError):
+        raise HTTPException(422, "timestamp must be ISO-8601")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat()
+
 def require_key(request: Request):
     key = request.headers.get("Authorization", "")
     if key.startswith("Bearer "):
         token = key.split(" ", 1)[1].strip()
     else:
         token = request.query_params.get("key")
-    if not API_KEY or token != API_KEY:
+    # compare_digest: konstantní čas, žádný early-exit podle shody prefixu
+    if not API_KEY or not token or not hmac.compare_digest(token.encode(), API_KEY.encode()):
         raise HTTPException(401, "Unauthorized: set EVENTS_API_KEY and include key")
 
 # --- LLU helpers ---
-def _mmol_to_mgdl(v: float) -> int:
-    return int(round(v * 18))
+_client_lock = threading.Lock()  # jediná autentizace i při souběžném cold startu
 
 def _make_client(api: APIUrl) -> PyLibreLinkUp:
     global _client
     if _client is not None:
         return _client
-    cli = PyLibreLinkUp(email=EMAIL, password=PASSWORD, api_url=api)
-    try:
-        cli.authenticate()
-    except RedirectError as e:
-        api2 = e.args[0] if isinstance(e.args[0], APIUrl) else api
-        cli = PyLibreLinkUp(email=EMAIL, password=PASSWORD, api_url=api2)
-        cli.authenticate()
-    _client = cli
-    return cli
+    with _client_lock:
+        # double-check: jiné vlákno mohlo klienta mezitím vytvořit
+        if _client is not None:
+            return _client
+        cli = PyLibreLinkUp(email=EMAIL, password=PASSWORD, api_url=api)
+        try:
+            cli.authenticate()
+        except RedirectError as e:
+            api2 = e.args[0] if isinstance(e.args[0], APIUrl) else api
+            cli = PyLibreLinkUp(email=EMAIL, password=PASSWORD, api_url=api2)
+            cli.authenticate()
+        _client = cli
+        return cli
+
+def _reset_client():
+    # po chybě (expirace tokenu apod.) se příště přihlásíme znovu
+    global _client, _patient
+    _client = None
+    _patient = None
 
 def _get_patient(cli: PyLibreLinkUp):
+    global _patient
+    if _patient is not None:
+        return _patient
     patients = cli.get_patients()
     if not patients:
         raise HTTPException(404, "No shared patients on this account.")
-    return patients[0]
+    _patient = patients[0]
+    return _patient
 
 def _downsample_stride(n: int, target: int) -> int:
     if n <= target:
@@ -105,106 +191,257 @@ def _downsample_stride(n: int, target: int) -> int:
 def _now():
     return datetime.now(timezone.utc)
 
+def _etag_for(ts_iso: str) -> str:
+    return f'W/"{int(datetime.fromisoformat(ts_iso).timestamp())}"'
+
+def _conditional_payload(request: Request, response: Response,
+                         payload: dict, ts_iso: Optional[str], max_age: int):
+    # ETag z časové značky posledního vzorku: klient pollující každých pár
+    # sekund dostane 304 bez těla, dokud se data nepohnou
+    if not ts_iso:
+        return payload
+    etag = _etag_for(ts_iso)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = f"max-age={max_age}"
+    return payload
+
+def _rate_limited_response(message: str, now: datetime) -> JSONResponse:
+    # 429 s Retry-After, aby klient/proxy věděl, kdy to zkusit znovu
+    retry_after = MIN_FETCH_INTERVAL_SEC
+    if _next_allowed_fetch_at and _next_allowed_fetch_at > now:
+        retry_after = int((_next_allowed_fetch_at - now).total_seconds()) + 1
+    return JSONResponse(
+        status_code=429,
+        content={"ok": False, "code": "agent.rate_limited", "message": message},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+# Synchronní (blokující) fetche – voláme je přes run_in_executor,
+# aby pod zámkem nestál celý event loop
+def _fetch_latest():
+    cli = _make_client(REGION)
+    patient = _get_patient(cli)
+    return cli.latest(patient_identifier=patient)
+
+def _fetch_graph():
+    cli = _make_client(REGION)
+    patient = _get_patient(cli)
+    return cli.graph(patient_identifier=patient)
+
+def _store_latest(m, now: datetime) -> dict:
+    global _latest_cache, _latest_cache_stale, _last_fetch_at, _next_allowed_fetch_at
+    payload = {
+        "value_mmol_l": m.value,
+        "value_mg_dl": int(m.value * 18 + 0.5),
+        "trend": getattr(m.trend, "name", str(m.trend)),
+        "timestamp": m.timestamp.isoformat(),
+    }
+    _latest_cache = (now, payload)
+    # stale variantu předpočítej hned: stale cesty pak vrací hotový dict
+    # bez per-request kopie
+    _latest_cache_stale = {**payload, "stale": True}
+    _last_fetch_at = now
+    _next_allowed_fetch_at = now + _MIN_INTERVAL
+    return payload
+
+async def _refresher():
+    # Jediný background fetcher: cache je skoro pořád čerstvá a klientské
+    # requesty tak nečekají na LLU round-trip; počet upstream volání je
+    # konstantní bez ohledu na QPS
+    global _next_allowed_fetch_at
+    loop = asyncio.get_running_loop()
+    while True:
+        sleep_for = MIN_FETCH_INTERVAL_SEC
+        try:
+            async with _latest_lock:
+                m = await loop.run_in_executor(_llu_pool, _fetch_latest)
+                _store_latest(m, _now())
+        except LLUAPIRateLimitError:
+            _next_allowed_fetch_at = _now() + _BACKOFF
+            sleep_for = BACKOFF_AFTER_429_SEC
+        except Exception:
+            # síť/auth výpadek → re-auth v dalším kole, endpoint vrátí stale
+            _reset_client()
+        await asyncio.sleep(sleep_for)
+
+@app.on_event("startup")
+async def _start_refresher():
+    if EMAIL and PASSWORD:
+        asyncio.create_task(_refresher())
+
+@app.on_event("shutdown")
+async def _shutdown_llu_pool():
+    _llu_pool.shutdown(wait=False)
+
 # --- endpoints: health ---
+# health payload je statický → postav ho jednou (load balancery se ptají často)
+_HEALTH_PAYLOAD = {
+    "ok": True,
+    "region": REGION_STR,
+    "cache_ttl_sec": CACHE_TTL_SEC,
+    "min_fetch_interval_sec": MIN_FETCH_INTERVAL_SEC,
+    "backoff_after_429_sec": BACKOFF_AFTER_429_SEC,
+    "events_storage": f"sqlite://{DB_PATH}",
+    "events_auth": "API key required" if API_KEY else "NO KEY SET (blocked)"
+}
+
 @app.get("/health")
 def health():
-    return {
-        "ok": True,
-        "region": str(REGION),
-        "cache_ttl_sec": CACHE_TTL_SEC,
-        "min_fetch_interval_sec": MIN_FETCH_INTERVAL_SEC,
-        "backoff_after_429_sec": BACKOFF_AFTER_429_SEC,
-        "events_storage": f"sqlite://{DB_PATH}",
-        "events_auth": "API key required" if API_KEY else "NO KEY SET (blocked)"
-    }
+    return _HEALTH_PAYLOAD
 
 # --- endpoints: glucose ---
 @app.get("/glucose/latest")
-def latest():
+async def latest(request: Request, response: Response):
     if not EMAIL or not PASSWORD:
         raise HTTPException(500, "Server not configured: missing LIBRE_EMAIL / LIBRE_PASSWORD")
 
-    global _latest_cache, _last_fetch_at, _next_allowed_fetch_at
+    global _next_allowed_fetch_at
     now = _now()
 
-    # 1) Pokud máme čerstvou cache, vrať ji
+    # 1) Pokud máme čerstvou cache (typicky díky _refresher), vrať ji (bez zámku – hot path)
     if _latest_cache:
         cached_at, payload = _latest_cache
-        if (now - cached_at) <= timedelta(seconds=CACHE_TTL_SEC):
-            return payload
+        if (now - cached_at) <= _CACHE_TTL:
+            return _conditional_payload(request, response, payload,
+                                        payload.get("timestamp"), CACHE_TTL_SEC)
 
-    # 2) Throttle: pokud je příliš brzo od posledního fetch / nebo běží backoff, vrať (stale) cache
-    if _next_allowed_fetch_at and now < _next_allowed_fetch_at:
-        if _latest_cache:
-            _, payload = _latest_cache
-            return {**payload, "stale": True, "throttled_until": _next_allowed_fetch_at.isoformat()}
-        raise HTTPException(429, "Throttled; try later")
+    # Single-flight: fetch dělá jen jedna coroutine, ostatní tu počkají
+    async with _latest_lock:
+        now = _now()
 
-    if _last_fetch_at and (now - _last_fetch_at) < timedelta(seconds=MIN_FETCH_INTERVAL_SEC):
+        # Double-check: někdo jiný mohl cache mezitím obnovit
         if _latest_cache:
-            _, payload = _latest_cache
-            return {**payload, "stale": True}
-        # kdyby nebyla cache, hold fetchneme i tak (výjimečně)
-
-    # 3) Pokus o čerstvý fetch
-    try:
-        cli = _make_client(REGION)
-        patient = _get_patient(cli)
-        m = cli.latest(patient_identifier=patient)
-        payload = {
-            "value_mmol_l": m.value,
-            "value_mg_dl": _mmol_to_mgdl(m.value),
-            "trend": getattr(m.trend, "name", str(m.trend)),
-            "timestamp": m.timestamp.isoformat(),
-        }
-        _latest_cache = (now, payload)
-        _last_fetch_at = now
-        _next_allowed_fetch_at = now + timedelta(seconds=MIN_FETCH_INTERVAL_SEC)
-        return payload
-
-    except LLUAPIRateLimitError:
-        # 429 → nastavíme backoff, vrátíme poslední známou (stale)
-        _next_allowed_fetch_at = now + timedelta(seconds=BACKOFF_AFTER_429_SEC)
-        if _latest_cache:
-            _, payload = _latest_cache
-            return {**payload, "stale": True, "backoff_until": _next_allowed_fetch_at.isoformat()}
-        raise HTTPException(429, "Rate limited by LLU; try later")
-
-    except Exception:
-        # jiná chyba → vrať stale pokud máme
-        if _latest_cache:
-            _, payload = _latest_cache
-            return {**payload, "stale": True}
-        raise HTTPException(503, "Upstream temporarily unavailable")
+            cached_at, payload = _latest_cache
+            if (now - cached_at) <= _CACHE_TTL:
+                return _conditional_payload(request, response, payload,
+                                            payload.get("timestamp"), CACHE_TTL_SEC)
+
+        # 2) Throttle: pokud je příliš brzo od posledního fetch / nebo běží backoff, vrať (stale) cache
+        if _next_allowed_fetch_at and now < _next_allowed_fetch_at:
+            if _latest_cache_stale:
+                # hot path pod throttle-stormem: žádná kopie dictu, kdy to
+                # zkusit znovu řekne hlavička
+                response.headers["Retry-After"] = str(
+                    int((_next_allowed_fetch_at - now).total_seconds()) + 1)
+                return _latest_cache_stale
+            return _rate_limited_response("Throttled; try later", now)
+
+        if _last_fetch_at and (now - _last_fetch_at) < _MIN_INTERVAL:
+            if _latest_cache_stale:
+                return _latest_cache_stale
+            # kdyby nebyla cache, hold fetchneme i tak (výjimečně)
+
+        # 3) Pokus o čerstvý fetch (fallback, když refresher ještě neběží / selhal)
+        try:
+            m = await asyncio.get_running_loop().run_in_executor(_llu_pool, _fetch_latest)
+            payload = _store_latest(m, now)
+            return _conditional_payload(request, response, payload,
+                                        payload.get("timestamp"), CACHE_TTL_SEC)
+
+        except LLUAPIRateLimitError:
+            # 429 → nastavíme backoff, vrátíme poslední známou (stale)
+            _next_allowed_fetch_at = now + _BACKOFF
+            if _latest_cache_stale:
+                # cold path (jednou za backoff) → malá kopie s backoff_until nevadí
+                return {**_latest_cache_stale, "backoff_until": _next_allowed_fetch_at.isoformat()}
+            return _rate_limited_response("Rate limited by LLU; try later", now)
+
+        except HTTPException:
+            raise
+
+        except Exception:
+            # jiná chyba → re-auth příště, vrať stale pokud máme
+            _reset_client()
+            if _latest_cache_stale:
+                return _latest_cache_stale
+            return JSONResponse(
+                status_code=503,
+                content={"ok": False, "code": "agent.upstream_unavailable",
+                         "message": "Upstream temporarily unavailable"},
+                headers={"Retry-After": str(MIN_FETCH_INTERVAL_SEC)},
+            )
+
+def _history_chunks(payload: dict):
+    # body serializujeme po jednom: první bajty letí hned po zformátování
+    # prvního bodu a nedržíme v paměti celé tělo vedle payloadu
+    yield b'{"points":['
+    first = True
+    for row in payload["points"]:
+        yield orjson.dumps(row) if first else b"," + orjson.dumps(row)
+        first = False
+    yield f'],"hours":{payload["hours"]},"count":{payload["count"]}}}'.encode()
+
+def _history_response(request: Request, payload: dict):
+    pts = payload["points"]
+    headers = {"Cache-Control": f"max-age={HISTORY_CACHE_TTL_SEC}"}
+    if pts:
+        etag = _etag_for(pts[-1]["timestamp"])
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        headers["ETag"] = etag
+    return StreamingResponse(_history_chunks(payload),
+                             media_type="application/json", headers=headers)
 
 @app.get("/glucose/history")
-def history(hours: int = Query(24, ge=1, le=168)):
+async def history(request: Request,
+                  hours: int = Query(24, ge=1, le=168),
+                  compact: int = Query(0, ge=0, le=1)):
     if not EMAIL or not PASSWORD:
         raise HTTPException(500, "Server not configured: missing LIBRE_EMAIL / LIBRE_PASSWORD")
 
-    cli = _make_client(REGION)
-    patient = _get_patient(cli)
-
-    series: List = cli.graph(patient_identifier=patient)  # cca 1min body
-    now = _now()
-    cutoff = now - timedelta(hours=hours)
-    pts = [p for p in series if getattr(p, "timestamp", now) >= cutoff]
-    pts.sort(key=lambda p: p.timestamp)
-
-    stride = _downsample_stride(len(pts), HISTORY_MAX_POINTS)
-    if stride > 1:
-        pts = pts[::stride]
-
-    data = [
-        {
-            "timestamp": p.timestamp.isoformat(),
-            "mmol": p.value,
-            "mgdl": _mmol_to_mgdl(p.value),
-            "trend": getattr(p.trend, "name", str(p.trend)),
-        }
-        for p in pts
-    ]
-    return {"points": data, "hours": hours, "count": len(data)}
+    # Data se u LLU mění max. 1× za minutu → kešuj hotový payload per okno
+    cache_key = (hours, compact)
+    cached = _history_cache.get(cache_key)
+    if cached and (_now() - cached[0]).total_seconds() <= HISTORY_CACHE_TTL_SEC:
+        return _history_response(request, cached[1])
+
+    # Single-flight per `hours`: souběžné dotazy na stejné okno nefetchují duplicitně
+    async with _history_lock(hours):
+        now = _now()
+        cached = _history_cache.get(cache_key)
+        if cached and (now - cached[0]).total_seconds() <= HISTORY_CACHE_TTL_SEC:
+            return _history_response(request, cached[1])
+
+        series: List = await asyncio.get_running_loop().run_in_executor(_llu_pool, _fetch_graph)  # cca 1min body
+        cutoff = now - timedelta(hours=hours)
+        # Seřaď jednou (graf z LLU je skoro seřazený → timsort je ~O(n)),
+        # pak SoA: ploché numpy kolony místo objekt+atribut per bod;
+        # cutoff přes searchsorted, downsample je jen stride-slice
+        series.sort(key=attrgetter("timestamp"))
+        n = len(series)
+        ts_col = np.fromiter((p.timestamp.timestamp() for p in series),
+                             dtype=np.float64, count=n)
+        val_col = np.fromiter((p.value for p in series), dtype=np.float32, count=n)
+
+        start = int(np.searchsorted(ts_col, cutoff.timestamp()))
+        stride = _downsample_stride(n - start, HISTORY_MAX_POINTS)
+        pts = series[start::stride]
+        vals = val_col[start::stride].astype(np.float64)
+        mgdl = np.rint(vals * 18).astype(np.int32).tolist()
+        if compact:
+            # kvantizace: mmol ×10 jako int (decimmol) – menší payload, int
+            # fast-path v orjson; frontend dělí deseti
+            mmol_key = "mmolx10"
+            mmol = np.rint(vals * 10).astype(np.int16).tolist()
+        else:
+            mmol_key = "mmol"
+            mmol = np.round(vals, 1).tolist()  # LLU reportuje na 1 desetinné místo
+
+        # ISO formátování a trend až pro finální výřez (≤ HISTORY_MAX_POINTS bodů)
+        data = [
+            {
+                "timestamp": p.timestamp.isoformat(),
+                mmol_key: v,
+                "mgdl": g,
+                "trend": getattr(p.trend, "name", str(p.trend)),
+            }
+            for p, v, g in zip(pts, mmol, mgdl)
+        ]
+        payload = {"points": data, "hours": hours, "count": len(data)}
+        _history_cache[cache_key] = (now, payload)
+        return _history_response(request, payload)
 
 # --- endpoints: insulin events (server persistence) ---
 @app.get("/events")
@@ -213,18 +450,10 @@ def list_events(request: Request,
                 until: Optional[str] = None,
                 limit: int = Query(500, ge=1, le=5000)):
     require_key(request)
-    q = "SELECT id,type,dose,ts FROM events"
-    clauses, params = [], []
-    if since:
-        clauses.append("ts >= ?"); params.append(since)
-    if until:
-        clauses.append("ts <= ?"); params.append(until)
-    if clauses:
-        q += " WHERE " + " AND ".join(clauses)
-    q += " ORDER BY ts DESC LIMIT ?"; params.append(limit)
-    conn = db()
-    rows = conn.execute(q, params).fetchall()
-    conn.close()
+    q = _SQL_EVENTS[(since is not None, until is not None)]
+    params = [p for p in (since, until) if p is not None]
+    params.append(limit)
+    rows = db().execute(q, params).fetchall()
     return {"events": [dict(r) for r in rows]}
 
 @app.post("/events")
@@ -233,7 +462,7 @@ async def create_event(request: Request):
     body = await request.json()
     typ = (body.get("type") or "").lower()
     dose = body.get("dose")
-    ts = body.get("timestamp") or _now().isoformat()
+    ts = _normalize_ts(body.get("timestamp") or _now().isoformat())
 
     if typ not in ("bolus", "basal"):
         raise HTTPException(422, "type must be 'bolus' or 'basal'")
@@ -242,19 +471,45 @@ async def create_event(request: Request):
 
     ev_id = str(uuid4())
     conn = db()
-    conn.execute("INSERT INTO events(id,type,dose,ts) VALUES (?,?,?,?)",
-                 (ev_id, typ, dose, ts))
-    conn.commit()
-    conn.close()
+    with _db_write_lock:
+        conn.execute("INSERT INTO events(id,type,dose,ts) VALUES (?,?,?,?)",
+                     (ev_id, typ, dose, ts))
+        conn.commit()
     return {"ok": True, "event": {"id": ev_id, "type": typ, "dose": dose, "timestamp": ts}}
 
+@app.post("/events:bulk")
+async def create_events_bulk(request: Request):
+    require_key(request)
+    body = await request.json()
+    if not isinstance(body, list) or not body:
+        raise HTTPException(422, "body must be a non-empty array of events")
+
+    rows = []
+    for i, item in enumerate(body):
+        typ = ((item.get("type") if isinstance(item, dict) else None) or "").lower()
+        dose = item.get("dose") if isinstance(item, dict) else None
+        ts = _normalize_ts((item.get("timestamp") if isinstance(item, dict) else None)
+                           or _now().isoformat())
+        if typ not in ("bolus", "basal"):
+            raise HTTPException(422, f"item {i}: type must be 'bolus' or 'basal'")
+        if not isinstance(dose, int):
+            raise HTTPException(422, f"item {i}: dose must be integer")
+        rows.append((str(uuid4()), typ, dose, ts))
+
+    # executemany v jedné transakci → jeden commit/fsync na celou dávku
+    conn = db()
+    with _db_write_lock, conn:
+        conn.executemany("INSERT INTO events(id,type,dose,ts) VALUES (?,?,?,?)", rows)
+    return {"ok": True, "inserted": len(rows),
+            "ids": [r[0] for r in rows]}
+
 @app.delete("/events/{event_id}")
 def delete_event(event_id: str, request: Request):
     require_key(request)
     conn = db()
-    cur = conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
-    conn.commit()
-    conn.close()
+    with _db_write_lock:
+        cur = conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
+        conn.commit()
     if cur.rowcount == 0:
         raise HTTPException(404, "event not found")
     return {"ok": True, "deleted": event_id}
@@ -1,10 +1,10 @@
 #!/usr/bin/env python
-import os, time
+import os, random, time
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 from pylibrelinkup import PyLibreLinkUp
 from pylibrelinkup.api_url import APIUrl
-from pylibrelinkup.exceptions import RedirectError
+from pylibrelinkup.exceptions import RedirectError, LLUAPIRateLimitError
 
 load_dotenv()
 
@@ -12,7 +12,21 @@ EMAIL = os.getenv("LIBRE_EMAIL")
 PASSWORD = os.getenv("LIBRE_PASSWORD")
 REGION = getattr(APIUrl, os.getenv("LIBRE_REGION", "EU"))
 
-POLL_SECONDS = 30  # LLU má nový vzorek ~každých 60 s
+POLL_SECONDS = 30       # fallback po chybě/re-auth
+SAMPLE_PERIOD = 60      # LLU má nový vzorek ~každých 60 s
+MIN_SLEEP = 5
+BACKOFF_BASE = 60       # první pauza po 429
+BACKOFF_CAP = 900       # strop exponenciálního backoffu
+
+def _retry_after_seconds(exc: Exception, default: int) -> int:
+    # Respektuj Retry-After, pokud ho upstream poslal – pylibrelinkup ho
+    # parsuje do atributu retry_after na výjimce
+    retry = getattr(exc, "retry_after", None)
+    try:
+        retry = int(retry)
+    except (TypeError, ValueError):
+        return default
+    return max(default, retry) if retry > 0 else default
 
 def login(api: APIUrl) -> PyLibreLinkUp:
     cli = PyLibreLinkUp(email=EMAIL, password=PASSWORD, api_url=api)
@@ -35,6 +49,7 @@ def main():
 
     patient = patients[0]
     last_ts = None
+    backoff = 0.0
 
     while True:
         try:
@@ -47,10 +62,23 @@ def main():
                     f"{datetime.now(timezone.utc).isoformat()}  "
                     f"{m.value:.1f} mmol/L ({mgdl} mg/dL)  {m.trend.name}"
                 )
+            backoff = 0.0
+            # adaptivně: další vzorek přijde ~60 s po tom posledním,
+            # spi jen zbytek periody + malý jitter
+            ts_utc = ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+            age = (datetime.now(timezone.utc) - ts_utc).total_seconds()
+            sleep_for = max(MIN_SLEEP, SAMPLE_PERIOD - age) + random.uniform(0, 5)
+        except LLUAPIRateLimitError as e:
+            # 429 → exponenciální backoff s jitterem, Retry-After má přednost
+            backoff = min(BACKOFF_CAP, backoff * 2 or BACKOFF_BASE) + random.random()
+            sleep_for = _retry_after_seconds(e, int(backoff))
+            # když vyhrál serverový hint, ať příští zdvojnásobení startuje z něj
+            backoff = max(backoff, sleep_for)
         except Exception:
             # síť/expirace tokenu apod. → re-auth
             cli = login(REGION)
-        time.sleep(POLL_SECONDS)
+            sleep_for = POLL_SECONDS
+        time.sleep(sleep_for)
 
 if __name__ == "__main__":
     main()